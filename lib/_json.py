@@ -28,11 +28,109 @@ extensions importing register_json from extras.
 # FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
 # License for more details.
 
+import re
 import json
 
-from psycopg2._psycopg import ISQLQuote, QuotedString
+from psycopg2._psycopg import ISQLQuote, QuotedString, encodings
 from psycopg2._psycopg import new_type, new_array_type, register_type
-from psycopg2.compat import PY2
+from psycopg2.compat import PY2, text_type
+
+
+def _resolve_json_impl():
+    """Return the default `!dumps()` and `!loads()` functions to use.
+
+    Use the fastest json implementations available, falling back on the
+    standard library module.
+    """
+    orjson = ujson = simplejson = None
+    try:
+        import orjson
+    except ImportError:
+        pass
+
+    try:
+        import ujson
+    except ImportError:
+        pass
+    else:
+        # Old ujson versions refuse big integers or parse floats imprecisely:
+        # don't use them.
+        try:
+            if ujson.loads('[18446744073709551616, 0.30000000000000004]') \
+                    != [18446744073709551616, 0.30000000000000004]:
+                ujson = None
+        except ValueError:
+            ujson = None
+
+    if ujson is None:
+        try:
+            import simplejson
+        except ImportError:
+            pass
+
+    # Emit non-ascii chars unescaped, as unicode strings. On Python 2 the
+    # modules would return an utf8-encoded str, which wouldn't be transcoded
+    # to the connection encoding.
+    ensure_ascii = PY2
+
+    # ujson and simplejson are not used to serialize: they accept objects
+    # the json module refuses (e.g. Decimal, losing precision in ujson) and
+    # serialize others differently (e.g. namedtuples in simplejson).
+    if orjson is not None:
+        # Fallback for the objects orjson refuses. It emits no whitespace,
+        # as orjson does, so the output doesn't depend on the path taken.
+        compact_encoder = json.JSONEncoder(
+            ensure_ascii=ensure_ascii, separators=(',', ':'))
+
+        # Don't let orjson serialize types the json module would refuse
+        # or serialize differently.
+        orjson_opts = (orjson.OPT_PASSTHROUGH_DATETIME
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+            | orjson.OPT_PASSTHROUGH_SUBCLASS)
+
+        # Notice that orjson dumps nan and infinity as null.
+        def dumps(obj):
+            try:
+                return orjson.dumps(obj, option=orjson_opts).decode('utf8')
+            except TypeError:
+                # orjson refuses objects the json module deals with, e.g.
+                # non-str dict keys or integers larger than 64 bits, and the
+                # passed through types.
+                return compact_encoder.encode(obj)
+
+    else:
+        # json.dumps() creates a new encoder on every call with non-default
+        # arguments: use a single one for the default dumps.
+        dumps = json.JSONEncoder(ensure_ascii=ensure_ascii).encode
+
+    # orjson is not used to parse: it silently converts integers larger than
+    # 64 bits to float, which json values from the database may well contain.
+    if ujson is not None:
+        loads = ujson.loads
+
+    elif simplejson is not None:
+        loads = simplejson.loads
+
+    else:
+        loads = json.loads
+
+    return dumps, loads
+
+
+_dumps, _loads = _resolve_json_impl()
+
+_re_non_ascii = re.compile(u'[^\x00-\x7f]')
+
+
+def _escape_non_ascii(m):
+    """Return the json escape sequence for the non-ascii char in *m*."""
+    c = ord(m.group())
+    if c < 0x10000:
+        return '\\u%04x' % c
+    else:
+        # represent the char as an utf-16 surrogate pair
+        c -= 0x10000
+        return '\\u%04x\\u%04x' % (0xd800 | (c >> 10), 0xdc00 | (c & 0x3ff))
 
 
 # oids from PostgreSQL 9.2
@@ -50,14 +148,19 @@ class Json(object):
     :sql:`json` data type.
 
     `!Json` can be used to wrap any object supported by the provided *dumps*
-    function. If none is provided, the standard :py:func:`json.dumps()` is
-    used.
+    function. If none is provided, `!orjson.dumps()` is used if available,
+    otherwise the standard :py:func:`json.dumps()`.
 
     """
+    __slots__ = ('adapted', '_conn', '_encoding', '_dumps')
+
+    _default_dumps = staticmethod(_dumps)
+
     def __init__(self, adapted, dumps=None):
         self.adapted = adapted
         self._conn = None
-        self._dumps = dumps or json.dumps
+        self._encoding = None
+        self._dumps = dumps or self._default_dumps
 
     def __conform__(self, proto):
         if proto is ISQLQuote:
@@ -66,17 +169,53 @@ class Json(object):
     def dumps(self, obj):
         """Serialize *obj* in JSON format.
 
-        The default is to call `!json.dumps()` or the *dumps* function
-        provided in the constructor. You can override this method to create a
-        customized JSON wrapper.
+        The default is to call the best `!dumps()` function available (see
+        above) or the *dumps* function provided in the constructor. You can
+        override this method to create a customized JSON wrapper.
+
+        The result is not required to be ASCII: characters the connection
+        encoding cannot represent are escaped when the value is quoted.
         """
         return self._dumps(obj)
 
     def prepare(self, conn):
         self._conn = conn
 
+        # With standard_conforming_strings only the quotes need escaping, so
+        # we can do it ourselves if we know how to encode the string.
+        if conn.get_parameter_status('standard_conforming_strings') == 'on':
+            self._encoding = conn.encoding == 'UTF8' and 'utf8' or 'ascii'
+        else:
+            self._encoding = None
+
     def getquoted(self):
         s = self.dumps(self.adapted)
+        if self._conn is None and isinstance(s, text_type):
+            # Without a connection QuotedString would encode in latin1, and
+            # __str__() would decode the result as ascii.
+            s = _re_non_ascii.sub(_escape_non_ascii, s)
+
+        if (self._encoding is not None and isinstance(s, text_type)
+                and '\0' not in s):
+            try:
+                b = s.encode(self._encoding)
+            except UnicodeEncodeError:
+                pass
+            else:
+                # join() allocates the result only once: it matters for
+                # large documents, where concatenation would copy them twice.
+                # replace() returns the same object if there is no quote,
+                # testing for "'" in b first would only add a scan.
+                return b"".join((b"'", b.replace(b"'", b"''"), b"'"))
+
+        try:
+            return self._quote(s)
+        except UnicodeEncodeError:
+            # Non-ascii chars can only be found in json strings, where they
+            # can be escaped, if the connection encoding cannot represent them
+            return self._quote(_re_non_ascii.sub(_escape_non_ascii, s))
+
+    def _quote(self, s):
         qs = QuotedString(s)
         if self._conn is not None:
             qs.prepare(self._conn)
@@ -87,8 +226,12 @@ class Json(object):
             return self.getquoted()
     else:
         def __str__(self):
-            # getquoted is binary in Py3
-            return self.getquoted().decode('ascii', 'replace')
+            # getquoted is binary in Py3, in the connection encoding if prepared
+            if self._conn is not None:
+                encoding = encodings[self._conn.encoding]
+            else:
+                encoding = 'ascii'
+            return self.getquoted().decode(encoding, 'replace')
 
 
 def register_json(conn_or_curs=None, globally=False, loads=None,
@@ -102,8 +245,8 @@ def register_json(conn_or_curs=None, globally=False, loads=None,
     :param globally: if `!False` register the typecasters only on
         *conn_or_curs*, otherwise register them globally
     :param loads: the function used to parse the data into a Python object. If
-        `!None` use `!json.loads()`, where `!json` is the module chosen
-        according to the Python version (see above)
+        `!None` use the first function available among `!ujson.loads()`,
+        `!simplejson.loads()` and the standard `!json.loads()`
     :param oid: the OID of the :sql:`json` type if known; If not, it will be
         queried on *conn_or_curs*
     :param array_oid: the OID of the :sql:`json[]` array type if known;
@@ -122,10 +265,11 @@ def register_json(conn_or_curs=None, globally=False, loads=None,
     JSON, JSONARRAY = _create_json_typecasters(
         oid, array_oid, loads=loads, name=name.upper())
 
-    register_type(JSON, not globally and conn_or_curs or None)
+    scope = None if globally else conn_or_curs
+    register_type(JSON, scope)
 
     if JSONARRAY is not None:
-        register_type(JSONARRAY, not globally and conn_or_curs or None)
+        register_type(JSONARRAY, scope)
 
     return JSON, JSONARRAY
 
@@ -159,9 +303,10 @@ def register_default_jsonb(conn_or_curs=None, globally=False, loads=None):
 def _create_json_typecasters(oid, array_oid, loads=None, name='JSON'):
     """Create typecasters for json data type."""
     if loads is None:
-        loads = json.loads
+        loads = _loads
 
-    def typecast_json(s, cur):
+    # loads is bound as default argument to make it a local in the function
+    def typecast_json(s, cur, loads=loads):
         if s is None:
             return None
         return loads(s)
@@ -175,6 +320,15 @@ def _create_json_typecasters(oid, array_oid, loads=None, name='JSON'):
     return JSON, JSONARRAY
 
 
+# Cache of the oids found by _get_json_oids(), by server, database and type
+# name. Only the oids of builtin types are cached: the ones of types created by
+# the user or by an extension change if the type is dropped and recreated.
+_oids_cache = {}
+
+# Oids lower than this are assigned to builtin objects (FirstNormalObjectId)
+_FIRST_NORMAL_OID = 16384
+
+
 def _get_json_oids(conn_or_curs, name='json'):
     # lazy imports
     from psycopg2.extensions import STATUS_IN_TRANSACTION
@@ -182,6 +336,12 @@ def _get_json_oids(conn_or_curs, name='json'):
 
     conn, curs = _solve_conn_curs(conn_or_curs)
 
+    key = (conn.info.host, conn.info.port, conn.info.server_version,
+        conn.info.dbname, name)
+    rv = _oids_cache.get(key)
+    if rv is not None:
+        return rv
+
     # Store the transaction status of the connection to revert it after use
     conn_status = conn.status
 
@@ -201,4 +361,7 @@ def _get_json_oids(conn_or_curs, name='json'):
     if not r:
         raise conn.ProgrammingError("%s data type not found" % name)
 
+    if r[0] < _FIRST_NORMAL_OID:
+        _oids_cache[key] = r
+
     return r
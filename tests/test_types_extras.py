@@ -16,23 +16,26 @@
 # License for more details.
 
 import re
+import sys
 import json
 import uuid
 import warnings
 from decimal import Decimal
 from datetime import date, datetime
+from collections import namedtuple
 from functools import wraps
 from pickle import dumps, loads
 
 import unittest
 from .testutils import (PY2, text_type, skip_if_no_uuid, skip_before_postgres,
     ConnectingTestCase, py3_raises_typeerror, slow, skip_from_python,
-    restore_types)
+    skip_before_python, restore_types)
 
 import psycopg2
 import psycopg2.extras
 import psycopg2.extensions as ext
-from psycopg2._json import _get_json_oids
+from psycopg2._json import (
+    _get_json_oids, _dumps, _oids_cache, _resolve_json_impl)
 from psycopg2.extras import (
     CompositeCaster, DateRange, DateTimeRange, DateTimeTZRange, HstoreAdapter,
     Inet, Json, NumericRange, Range, RealDictConnection,
@@ -40,6 +43,11 @@ from psycopg2.extras import (
 )
 from psycopg2.tz import FixedOffsetTimezone
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class TypesExtrasTests(ConnectingTestCase):
     """Test that all type conversions are working."""
@@ -793,9 +801,47 @@ class JsonTestCase(ConnectingTestCase):
 
         curs = self.conn.cursor()
         for obj in enumerate(objs):
-            self.assertQuotedEqual(curs.mogrify("%s", (Json(obj),)),
+            self.assertQuotedEqual(
+                curs.mogrify("%s", (Json(obj, dumps=json.dumps),)),
                 psycopg2.extensions.QuotedString(json.dumps(obj)).getquoted())
 
+    def test_default_dumps(self):
+        obj = [None, "te'xt", 123, 123.45, {'a': [1, True]}]
+        if orjson is not None:
+            self.assertEqual(_dumps(obj),
+                '[null,"te\'xt",123,123.45,{"a":[1,true]}]')
+        else:
+            self.assertEqual(_dumps(obj),
+                '[null, "te\'xt", 123, 123.45, {"a": [1, true]}]')
+
+    def test_adapt_int_keys(self):
+        curs = self.conn.cursor()
+        self.assertEqual(curs.mogrify("%s", (Json({1: 2}),)),
+            curs.mogrify("%s", (Json({'1': 2}),)))
+
+    def test_adapt_nan(self):
+        curs = self.conn.cursor()
+        if orjson is not None:
+            # orjson doesn't emit non-finite numbers
+            nan, inf = b"'null'", b"'[null]'"
+        else:
+            nan, inf = b"'NaN'", b"'[Infinity]'"
+
+        self.assertQuotedEqual(
+            curs.mogrify("%s", (Json(float('nan')),)), nan)
+        self.assertQuotedEqual(
+            curs.mogrify("%s", (Json([float('inf')]),)), inf)
+        self.assertQuotedEqual(
+            curs.mogrify("%s", (Json(float('nan'), dumps=json.dumps),)),
+            b"'NaN'")
+
+    def test_adapt_datetime(self):
+        curs = self.conn.cursor()
+        self.assertRaises(TypeError,
+            curs.mogrify, "%s", (Json(date(2020, 1, 1)),))
+        self.assertRaises(TypeError,
+            curs.mogrify, "%s", (Json({'a': datetime(2020, 1, 1)}),))
+
     def test_adapt_dumps(self):
         class DecimalEncoder(json.JSONEncoder):
             def default(self, obj):
@@ -826,14 +872,105 @@ class JsonTestCase(ConnectingTestCase):
         obj = Decimal('123.45')
         self.assertQuotedEqual(curs.mogrify("%s", (MyJson(obj),)), b"'123.45'")
 
+    def test_slots(self):
+        j = Json({'a': 1})
+        self.assertRaises(AttributeError, setattr, j, 'foo', 1)
+
+        class MyJson(Json):
+            pass
+
+        j = MyJson({'a': 1})
+        j.foo = 1
+        self.assertEqual(j.foo, 1)
+
+        curs = self.conn.cursor()
+        self.assertQuotedEqual(curs.mogrify("%s", (j,)),
+            curs.mogrify("%s", (Json({'a': 1}),)))
+
     @restore_types
     def test_register_on_dict(self):
         psycopg2.extensions.register_adapter(dict, Json)
 
         curs = self.conn.cursor()
         obj = {'a': 123}
-        self.assertQuotedEqual(
-            curs.mogrify("%s", (obj,)), b"""'{"a": 123}'""")
+        if orjson is not None:
+            self.assertEqual(curs.mogrify("%s", (obj,)), b"""'{"a":123}'""")
+        else:
+            self.assertEqual(curs.mogrify("%s", (obj,)), b"""'{"a": 123}'""")
+
+    def test_adapt_quotes(self):
+        obj = {'a': u"te'xt \xe0\u20ac", "b'": "\\"}
+
+        def dumps(obj):
+            return json.dumps(obj, ensure_ascii=False)
+
+        for enc in ('UTF8', 'LATIN9'):
+            self.conn.set_client_encoding(enc)
+            curs = self.conn.cursor()
+            for j in (Json(obj), Json(obj, dumps=dumps)):
+                qs = psycopg2.extensions.QuotedString(j.dumps(obj))
+                qs.prepare(self.conn)
+                self.assertEqual(curs.mogrify("%s", (j,)), qs.getquoted())
+
+    def test_adapt_non_ascii(self):
+        def dumps(obj):
+            return json.dumps(obj, ensure_ascii=False)
+
+        obj = {'a': u"\xe0\u2603\U0001f600"}
+        for j in (Json(obj), Json(obj, dumps=dumps)):
+            self.conn.set_client_encoding('UTF8')
+            curs = self.conn.cursor()
+            self.assertEqual(json.loads(
+                curs.mogrify("%s", (j,)).decode('utf8')[1:-1]), obj)
+
+            # Chars not in the connection encoding are escaped
+            self.conn.set_client_encoding('LATIN1')
+            curs = self.conn.cursor()
+            self.assertEqual(json.loads(
+                curs.mogrify("%s", (j,)).decode('ascii')[1:-1]), obj)
+
+        self.assertQuotedEqual(curs.mogrify("%s", (Json(obj, dumps=dumps),)),
+            b'\'{"a": "\\u00e0\\u2603\\ud83d\\ude00"}\'')
+
+    def test_unprepared_non_ascii(self):
+        def dumps(obj):
+            return json.dumps(obj, ensure_ascii=False)
+
+        obj = {'a': u"caf\xe9 \u2603"}
+        for j in (Json(obj), Json(obj, dumps=dumps),
+                psycopg2.extensions.adapt(Json(obj))):
+            self.assertEqual(
+                json.loads(j.getquoted().decode('ascii')[1:-1]), obj)
+            self.assertEqual(json.loads(str(j)[1:-1]), obj)
+
+        self.assertEqual(Json(obj, dumps=dumps).getquoted(),
+            b'\'{"a": "caf\\u00e9 \\u2603"}\'')
+
+    @skip_before_python(3)
+    def test_prepared_non_ascii(self):
+        def dumps(obj):
+            return json.dumps(obj, ensure_ascii=False)
+
+        obj = {'a': u"caf\xe9 \u2603"}
+        self.conn.set_client_encoding('UTF8')
+        j = Json(obj, dumps=dumps)
+        j.prepare(self.conn)
+        s = str(j)
+        self.assertEqual(json.loads(s[s.index("'") + 1:-1]), obj)
+        self.assert_(u"caf\xe9 \u2603" in s)
+
+        obj = {'a': u"caf\xe9"}
+        self.conn.set_client_encoding('LATIN1')
+        j = Json(obj, dumps=dumps)
+        j.prepare(self.conn)
+        s = str(j)
+        self.assertEqual(json.loads(s[s.index("'") + 1:-1]), obj)
+        self.assert_(u"caf\xe9" in s)
+
+    def test_adapt_big_int(self):
+        curs = self.conn.cursor()
+        self.assertQuotedEqual(curs.mogrify("%s", (Json(2 ** 70),)),
+            b"'1180591620717411303424'")
 
     def test_type_not_available(self):
         curs = self.conn.cursor()
@@ -905,6 +1042,42 @@ class JsonTestCase(ConnectingTestCase):
         self.assert_(isinstance(data['a'], Decimal))
         self.assertEqual(data['a'], Decimal('100.0'))
 
+    @skip_if_no_json_type
+    def test_oids_cached(self):
+        oids = _get_json_oids(self.conn)
+        curs = self.conn.cursor()
+        self.assertRaises(psycopg2.ProgrammingError,
+            curs.execute, "select nosuchcolumn")
+
+        # The transaction is failed: a query would raise an error
+        self.assertEqual(_get_json_oids(self.conn), oids)
+        self.assertEqual(_get_json_oids(curs), oids)
+
+    def test_oids_not_cached(self):
+        curs = self.conn.cursor()
+        curs.execute("create temp table jsontmp (a int)")
+        oids = _get_json_oids(self.conn, 'jsontmp')
+        self.assert_(oids[0] >= 16384)
+        self.assert_(not [k for k in _oids_cache if k[-1] == 'jsontmp'])
+
+        # A recreated type gets new oids
+        curs.execute("drop table jsontmp")
+        curs.execute("create temp table jsontmp (a int)")
+        self.assertNotEqual(_get_json_oids(self.conn, 'jsontmp'), oids)
+
+    @skip_if_no_json_type
+    def test_oids_status(self):
+        _oids_cache.clear()
+        self.assertEqual(self.conn.status, ext.STATUS_READY)
+        _get_json_oids(self.conn)
+        self.assertEqual(self.conn.status, ext.STATUS_READY)
+
+        _oids_cache.clear()
+        curs = self.conn.cursor()
+        curs.execute("select 1")
+        _get_json_oids(self.conn)
+        self.assertEqual(self.conn.status, ext.STATUS_IN_TRANSACTION)
+
     @skip_before_postgres(9, 2)
     def test_register_default(self):
         curs = self.conn.cursor()
@@ -923,6 +1096,14 @@ class JsonTestCase(ConnectingTestCase):
         self.assert_(isinstance(data[0]['a'], Decimal))
         self.assertEqual(data[0]['a'], Decimal('100.0'))
 
+    @skip_before_postgres(9, 2)
+    def test_load_big_int(self):
+        curs = self.conn.cursor()
+        curs.execute("""select '{"a": 1180591620717411303424}'::json""")
+        data = curs.fetchone()[0]
+        self.assertEqual(data['a'], 2 ** 70)
+        self.assert_(not isinstance(data['a'], float))
+
     @skip_if_no_json_type
     def test_null(self):
         psycopg2.extras.register_json(self.conn)
@@ -958,17 +1139,17 @@ class JsonTestCase(ConnectingTestCase):
         cnn_on = self.connect(options="-c standard_conforming_strings=on")
         cur_on = cnn_on.cursor()
         self.assertEqual(
-            cur_on.mogrify("%s", [psycopg2.extras.Json({'a': '"'})]),
+            cur_on.mogrify("%s", [Json({'a': '"'}, dumps=json.dumps)]),
             b'\'{"a": "\\""}\'')
 
         cnn_off = self.connect(options="-c standard_conforming_strings=off")
         cur_off = cnn_off.cursor()
         self.assertEqual(
-            cur_off.mogrify("%s", [psycopg2.extras.Json({'a': '"'})]),
+            cur_off.mogrify("%s", [Json({'a': '"'}, dumps=json.dumps)]),
             b'E\'{"a": "\\\\""}\'')
 
         self.assertEqual(
-            cur_on.mogrify("%s", [psycopg2.extras.Json({'a': '"'})]),
+            cur_on.mogrify("%s", [Json({'a': '"'}, dumps=json.dumps)]),
             b'\'{"a": "\\""}\'')
 
 
@@ -1057,6 +1238,77 @@ class JsonbTestCase(ConnectingTestCase):
         self.assertEqual(curs.fetchone()[0], None)
 
 
+class JsonImplTestCase(unittest.TestCase):
+    """Test the default json functions with different modules available."""
+    def resolve(self, *hidden, **modules):
+        """Call _resolve_json_impl() making the *hidden* modules missing.
+
+        Use the objects in *modules* in place of the modules with their names.
+        """
+        modules.update(dict.fromkeys(hidden))
+        saved = dict((name, sys.modules.pop(name, None)) for name in modules)
+        sys.modules.update(modules)
+        try:
+            return _resolve_json_impl()
+        finally:
+            for name, mod in saved.items():
+                if mod is not None:
+                    sys.modules[name] = mod
+                else:
+                    del sys.modules[name]
+
+    def check_refused(self, dumps):
+        for obj in [Decimal('0.1000000000000000000001'), date(2020, 1, 1),
+                {'a': datetime(2020, 1, 1)}, b'abc']:
+            self.assertRaises(TypeError, dumps, obj)
+
+    def test_dumps_json(self):
+        Point = namedtuple('Point', 'x y')
+        for hidden in [('orjson',), ('orjson', 'ujson'),
+                ('orjson', 'ujson', 'simplejson')]:
+            dumps = self.resolve(*hidden)[0]
+            self.assertEqual(dumps(Point(1, 2)), '[1, 2]')
+            self.assertEqual(dumps(float('nan')), 'NaN')
+            self.assertEqual(dumps([float('inf')]), '[Infinity]')
+            self.assertEqual(dumps(2 ** 70), '1180591620717411303424')
+            self.assertEqual(dumps({1: 2}), '{"1": 2}')
+            self.check_refused(dumps)
+            self.assertRaises(TypeError, dumps, uuid.UUID(int=1))
+
+    def test_dumps_orjson(self):
+        if orjson is None:
+            return self.skipTest("orjson not available")
+
+        Point = namedtuple('Point', 'x y')
+        dumps = self.resolve()[0]
+        self.assertEqual(dumps(Point(1, 2)), '[1,2]')
+        self.assertEqual(dumps(float('nan')), 'null')
+        self.assertEqual(dumps([float('inf')]), '[null]')
+        self.assertEqual(dumps(2 ** 70), '1180591620717411303424')
+        self.assertEqual(dumps({1: 2}), '{"1":2}')
+        self.check_refused(dumps)
+        self.assertEqual(dumps(uuid.UUID(int=1)),
+            '"00000000-0000-0000-0000-000000000001"')
+
+    def test_loads(self):
+        for hidden in [(), ('ujson',), ('ujson', 'simplejson')]:
+            loads = self.resolve(*hidden)[1]
+            data = loads('[18446744073709551616, 0.1, null, "\\u00e0"]')
+            self.assertEqual(data, [2 ** 64, 0.1, None, u'\xe0'])
+            self.assert_(not isinstance(data[0], float))
+            self.assertRaises(ValueError, loads, '{bad')
+
+    def test_loads_old_ujson(self):
+        class OldUjson(object):
+            @staticmethod
+            def loads(s):
+                raise ValueError("Value is too big!")
+
+        loads = self.resolve(ujson=OldUjson)[1]
+        self.assert_(loads is not OldUjson.loads)
+        self.assertEqual(loads('[18446744073709551616]'), [2 ** 64])
+
+
 class RangeTestCase(unittest.TestCase):
     def test_noparam(self):
         r = Range()